@@ -31,10 +31,7 @@ class EmployeeProject(Model):
     hours = Column('INTEGER')
 
 # Crear todas las tablas
-Department.create_table()
-Employee.create_table()
-Project.create_table()
-EmployeeProject.create_table()
+Model.create_all([Department, Employee, Project, EmployeeProject])
 
 # Insertar datos de ejemplo
 it = Department(name="IT", budget=100000)
@@ -49,8 +46,7 @@ employees = [
     Employee(name="Pedro Martínez", email="pedro@example.com", salary=38000, department_id=hr.id)
 ]
 
-for emp in employees:
-    emp.save()
+Employee.bulk_save(employees)
 
 projects = [
     Project(name="Sistema de Gestión", deadline="2023-12-31"),
@@ -58,8 +54,7 @@ projects = [
     Project(name="App Móvil", deadline="2024-02-28")
 ]
 
-for proj in projects:
-    proj.save()
+Project.bulk_save(projects)
 
 # Asignar empleados a proyectos
 assignments = [
@@ -69,8 +64,7 @@ assignments = [
     EmployeeProject(employee_id=employees[2].id, project_id=projects[2].id, hours=25)
 ]
 
-for assign in assignments:
-    assign.save()
+EmployeeProject.bulk_save(assignments)
 
 # Consultas avanzadas
 print("\n=== Todos los empleados del departamento IT ===")
@@ -1,8 +1,23 @@
+import queue
+import re
 import sqlite3
-from typing import List, Dict, Union, Optional, Type, TypeVar, Any, Tuple
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Dict, Union, Optional, Type, TypeVar, Any, Tuple, Iterator, Callable
 
 T = TypeVar('T', bound='Model')
 
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+_TABLE_REFERENCE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\s+(AS\s+)?[A-Za-z_][A-Za-z0-9_]*)?$', re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def _check_identifier(name: str, pattern: 're.Pattern' = _IDENTIFIER) -> str:
+    # Cada identificador distinto se valida una sola vez
+    if not pattern.match(name):
+        raise ValueError(f"Identificador no válido: '{name}'")
+    return name
+
 class ForeignKey:
     def __init__(self, model: Type['Model'], nullable: bool = False):
         self.model = model
@@ -13,177 +28,534 @@ class ForeignKey:
         return "INTEGER"
 
 class Column:
-    def __init__(self, sql_type: str, primary_key: bool = False, nullable: bool = True, unique: bool = False):
+    def __init__(self, sql_type: str, primary_key: bool = False, nullable: bool = True, unique: bool = False,
+                 converter: Optional[Callable[[Any], Any]] = None, index: bool = False):
         self.sql_type = sql_type
         self.primary_key = primary_key
         self.nullable = nullable
         self.unique = unique
+        self.index = index
+        # Se aplica solo a esta columna al construir las instancias
+        self.converter = converter
+
+class _PooledConnection(sqlite3.Connection):
+    # Generación del pool en la que se abrió; close_connection() la invalida
+    generation = 0
+
+class _ConnectionState(threading.local):
+    # Conexión fijada al hilo (transacción activa o get_connection())
+    conn = None
+    depth = 0
+
+class ModelMeta(type):
+    # Las columnas declaradas se convierten en __slots__: la lectura de un
+    # campo es un acceso directo al slot, sin diccionario por instancia
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        declared = {
+            key: value for key, value in namespace.items()
+            if isinstance(value, (Column, ForeignKey))
+        }
+        for key in declared:
+            del namespace[key]
+        namespace['__slots__'] = tuple(namespace.get('__slots__', ())) + tuple(declared)
+        namespace['_declared_fields'] = declared
+        return super().__new__(mcs, name, bases, namespace, **kwargs)
 
-class Model:
+class Model(metaclass=ModelMeta):
+    __slots__ = ('_modified', '_relations', '_extra')
+    
     _table_name = None
     
+    # Pool de conexiones compartido por todos los modelos
+    _pool_size = 8
+    _pool_timeout = 30.0
+    _pool = queue.LifoQueue(maxsize=_pool_size)
+    _pool_lock = threading.Lock()
+    _opened: List[sqlite3.Connection] = []
+    _generation = 0
+    _local = _ConnectionState()
+    _pragmas = (
+        "PRAGMA journal_mode = WAL;"
+        "PRAGMA synchronous = NORMAL;"
+        "PRAGMA temp_store = MEMORY;"
+        "PRAGMA mmap_size = 268435456;"
+        "PRAGMA cache_size = -64000;"
+        "PRAGMA foreign_keys = ON;"
+        "PRAGMA busy_timeout = 5000;"
+    )
+    
+    # Metadatos calculados una sola vez por clase en __init_subclass__
+    _fields: Dict[str, Union[Column, ForeignKey]] = {}
+    _columns: Tuple[str, ...] = ()
+    _fk_cols: Tuple[str, ...] = ()
+    _pk = 'id'
+    _create_sql = None
+    _indexes: Tuple[Tuple[str, str], ...] = ()
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        
+        fields = dict(cls._fields)
+        fields.update(cls._declared_fields)
+        
+        cls._fields = fields
+        cls._columns = tuple(fields)
+        cls._fk_cols = tuple(name for name, field in fields.items() if isinstance(field, ForeignKey))
+        cls._pk = next(
+            (name for name, field in fields.items() if isinstance(field, Column) and field.primary_key),
+            'id'
+        )
+        cls._create_sql = cls._build_create_sql() if cls._table_name else None
+        cls._indexes = cls._build_indexes() if cls._table_name else ()
+    
+    @classmethod
+    def _build_create_sql(cls) -> str:
+        columns = []
+        primary_keys = []
+        foreign_keys = []
+        
+        for name, field in cls._fields.items():
+            if isinstance(field, Column):
+                nullable = " NULL" if field.nullable else " NOT NULL"
+                columns.append(f"{name} {field.sql_type}{nullable}")
+                if field.primary_key:
+                    primary_keys.append(name)
+            else:
+                nullable = " NULL" if field.nullable else " NOT NULL"
+                columns.append(f"{name} {field.sql_type}{nullable}")
+                foreign_keys.append((name, field))
+        
+        pk_clause = f", PRIMARY KEY ({', '.join(primary_keys)})" if primary_keys else ""
+        
+        fk_clauses = []
+        for fk_name, field in foreign_keys:
+            fk_clauses.append(
+                f", FOREIGN KEY({fk_name}) REFERENCES {field.model._table_name}({field.model._pk}) "
+                f"ON DELETE {'SET NULL' if field.nullable else 'CASCADE'}"
+            )
+        
+        return f"CREATE TABLE IF NOT EXISTS {cls._table_name} ({', '.join(columns)}{pk_clause}{''.join(fk_clauses)})"
+    
+    @classmethod
+    def _build_indexes(cls) -> Tuple[Tuple[str, str], ...]:
+        # UNIQUE y los índices secundarios se crean aparte de la tabla para
+        # poder eliminarlos durante una carga masiva y recrearlos después
+        indexes = []
+        for name, field in cls._fields.items():
+            if not isinstance(field, Column) or field.primary_key:
+                continue
+            if field.unique:
+                index_name = f"ux_{cls._table_name}_{name}"
+                indexes.append((index_name, f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {cls._table_name} ({name})"))
+            elif field.index:
+                index_name = f"ix_{cls._table_name}_{name}"
+                indexes.append((index_name, f"CREATE INDEX IF NOT EXISTS {index_name} ON {cls._table_name} ({name})"))
+        return tuple(indexes)
+    
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _insert_sql_for(cls, columns: Tuple[str, ...]) -> str:
+        placeholders = ', '.join(['?'] * len(columns))
+        return f"INSERT INTO {cls._table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+    
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _update_sql_for(cls, columns: Tuple[str, ...]) -> str:
+        set_clause = ', '.join([f"{col} = ?" for col in columns])
+        return f"UPDATE {cls._table_name} SET {set_clause} WHERE {cls._pk} = ?"
+    
     def __init__(self, **kwargs):
-        self._data = kwargs
         self._modified = set()
         self._relations = {}
-        
+        self._extra = {}
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+        self._modified.clear()
+    
     def __getattr__(self, name):
-        if name in self._data:
-            return self._data[name]
+        # Solo se invoca si no hay slot asignado: columnas extra de un JOIN
+        # o relaciones cargadas
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._extra:
+            return self._extra[name]
         elif name in self._relations:
             return self._relations[name]
         raise AttributeError(f"'{self.__class__.__name__}' no tiene el atributo '{name}'")
     
     def __setattr__(self, name, value):
-        if name.startswith('_'):
-            super().__setattr__(name, value)
+        if name in self._fields:
+            object.__setattr__(self, name, value)
+            self._modified.add(name)
+            if name in self._fk_cols:
+                # La relación precargada ya no corresponde a la nueva clave
+                self._relations.pop(self._relation_name(name), None)
+        elif name.startswith('_'):
+            object.__setattr__(self, name, value)
         elif name in self._relations:
             self._relations[name] = value
         else:
-            self._data[name] = value
-            self._modified.add(name)
+            self._extra[name] = value
+    
+    def _assign(self, name: str, value: Any):
+        # Asigna un valor leído de la base de datos sin marcarlo como modificado
+        if name in self._fields:
+            object.__setattr__(self, name, value)
+        else:
+            self._extra[name] = value
+    
+    def _column_values(self) -> Dict[str, Any]:
+        values = {}
+        for name in self._columns:
+            try:
+                values[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return values
+    
+    @classmethod
+    def _connect(cls) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            'database.db',
+            cached_statements=256,
+            check_same_thread=False,
+            isolation_level=None,
+            factory=_PooledConnection
+        )
+        conn.generation = Model._generation
+        conn.row_factory = sqlite3.Row
+        conn.executescript(Model._pragmas)
+        return conn
+    
+    @classmethod
+    def _checkout(cls) -> sqlite3.Connection:
+        try:
+            return Model._pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with Model._pool_lock:
+            if len(Model._opened) < Model._pool_size:
+                conn = cls._connect()
+                Model._opened.append(conn)
+                return conn
+        
+        try:
+            return Model._pool.get(timeout=Model._pool_timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No hay conexiones libres en el pool ({Model._pool_size}) tras "
+                f"{Model._pool_timeout}s: cierra iteradores abiertos o usa close_connection()"
+            ) from None
+    
+    @classmethod
+    def _release(cls, conn: sqlite3.Connection):
+        with Model._pool_lock:
+            if conn.generation == Model._generation:
+                Model._pool.put_nowait(conn)
+                return
+        # Abierta antes del último close_connection(): no vuelve al pool
+        conn.close()
+    
+    @classmethod
+    def _held_connection(cls) -> Optional[sqlite3.Connection]:
+        local = Model._local
+        held = local.conn
+        if held is not None and not local.depth and held.generation != Model._generation:
+            # Conexión fijada a este hilo antes de close_connection()
+            held.close()
+            local.conn = held = None
+        return held
+    
+    @classmethod
+    @contextmanager
+    def acquire(cls):
+        held = cls._held_connection()
+        if held is not None:
+            yield held
+            return
+        
+        conn = cls._checkout()
+        try:
+            yield conn
+        finally:
+            cls._release(conn)
     
     @classmethod
     def get_connection(cls) -> sqlite3.Connection:
-        if not hasattr(cls, '_conn'):
-            cls._conn = sqlite3.connect('database.db', detect_types=sqlite3.PARSE_DECLTYPES)
-            cls._conn.row_factory = sqlite3.Row
-            cls._conn.execute("PRAGMA foreign_keys = ON")
-        return cls._conn
+        # Conexión propia del hilo, fuera del pool: no ocupa capacidad y se
+        # libera con el hilo o con close_connection()
+        held = cls._held_connection()
+        if held is None:
+            held = Model._local.conn = cls._connect()
+        return held
     
     @classmethod
     def close_connection(cls):
-        if hasattr(cls, '_conn'):
-            cls._conn.close()
-            delattr(cls, '_conn')
+        # Cierra las conexiones libres; las que están en uso se cierran al
+        # devolverse y las fijadas a otros hilos en su siguiente uso
+        with Model._pool_lock:
+            Model._generation += 1
+            Model._opened.clear()
+            idle, Model._pool = Model._pool, queue.LifoQueue(maxsize=Model._pool_size)
+        
+        while True:
+            try:
+                idle.get_nowait().close()
+            except queue.Empty:
+                break
+        
+        held = Model._local.conn
+        if held is not None and not Model._local.depth:
+            held.close()
+            Model._local.conn = None
+    
+    @classmethod
+    @contextmanager
+    def transaction(cls):
+        local = Model._local
+        if local.depth:
+            # Transacción anidada: se une a la exterior
+            local.depth += 1
+            try:
+                yield local.conn
+            finally:
+                local.depth -= 1
+            return
+        
+        # Las conexiones están en modo autocommit (isolation_level=None):
+        # fuera de transaction() cada sentencia se confirma por sí sola.
+        # IMMEDIATE toma el bloqueo de escritura al inicio para que
+        # busy_timeout actúe en vez de fallar al escribir
+        with cls.acquire() as conn:
+            held = local.conn
+            local.conn = conn
+            local.depth = 1
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                # SQLite puede haber deshecho ya la transacción
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+            finally:
+                local.depth = 0
+                local.conn = held
     
     @classmethod
     def create_table(cls):
         if not cls._table_name:
             raise ValueError("Nombre de tabla no definido")
-            
-        columns = []
-        primary_keys = []
-        foreign_keys = []
-        unique_constraints = []
-        
-        for name, field in cls.__dict__.items():
-            if isinstance(field, Column):
-                nullable = " NULL" if field.nullable else " NOT NULL"
-                unique = " UNIQUE" if field.unique else ""
-                columns.append(f"{name} {field.sql_type}{nullable}{unique}")
-                if field.primary_key:
-                    primary_keys.append(name)
-                if field.unique and not field.primary_key:
-                    unique_constraints.append(name)
-            elif isinstance(field, ForeignKey):
-                nullable = " NULL" if field.nullable else " NOT NULL"
-                columns.append(f"{name} {field.sql_type}{nullable}")
-                foreign_keys.append((name, field.model))
-        
-        pk_clause = f", PRIMARY KEY ({', '.join(primary_keys)})" if primary_keys else ""
-        
-        fk_clauses = []
-        for fk_name, model in foreign_keys:
-            fk_clauses.append(
-                f", FOREIGN KEY({fk_name}) REFERENCES {model._table_name}({model.get_primary_key()}) "
-                f"ON DELETE {'SET NULL' if field.nullable else 'CASCADE'}"
-            )
-        
-        unique_clauses = [
-            f", UNIQUE({col})" for col in unique_constraints
-        ]
         
-        sql = f"CREATE TABLE IF NOT EXISTS {cls._table_name} ({', '.join(columns)}{pk_clause}{''.join(fk_clauses)}{''.join(unique_clauses)})"
+        cls._execute_script([cls._create_sql] + [sql for _, sql in cls._indexes])
+    
+    @classmethod
+    def create_all(cls, models: List[Type['Model']]):
+        statements = []
+        for model in models:
+            if not model._table_name:
+                raise ValueError("Nombre de tabla no definido")
+            statements.append(model._create_sql)
+            statements.extend(sql for _, sql in model._indexes)
+        cls._execute_script(statements)
+    
+    @classmethod
+    def drop_indexes(cls):
+        cls._execute_script([f"DROP INDEX IF EXISTS {name}" for name, _ in cls._indexes])
+    
+    @classmethod
+    def recreate_indexes(cls):
+        cls._execute_script([sql for _, sql in cls._indexes])
+    
+    @classmethod
+    def _execute_script(cls, statements: List[str]):
+        if not statements:
+            return
         
-        conn = cls.get_connection()
-        conn.execute(sql)
-        conn.commit()
+        with cls.acquire() as conn:
+            if Model._local.depth:
+                # executescript confirmaría la transacción en curso
+                for statement in statements:
+                    conn.execute(statement)
+                return
+            
+            try:
+                conn.executescript("BEGIN;\n" + ";\n".join(statements) + ";\nCOMMIT;")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
     
     @classmethod
     def get_primary_key(cls) -> str:
-        for name, field in cls.__dict__.items():
-            if isinstance(field, Column) and field.primary_key:
-                return name
-        return 'id'
+        return cls._pk
     
     def save(self):
         if not self._table_name:
             raise ValueError("Nombre de tabla no definido")
             
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         pk = self.__class__.get_primary_key()
-        pk_value = self._data.get(pk)
+        data = self._column_values()
+        pk_value = data.get(pk)
         
         if pk_value is not None:
             # Actualización
-            set_clause = ', '.join([f"{col} = ?" for col in self._modified])
-            values = [self._data[col] for col in self._modified]
+            if not self._modified:
+                return
+            columns = tuple(sorted(self._modified))
+            values = [data[col] for col in columns]
             values.append(pk_value)
-            
-            sql = f"UPDATE {self._table_name} SET {set_clause} WHERE {pk} = ?"
-            cursor.execute(sql, values)
+            sql = self._update_sql_for(columns)
         else:
             # Inserción
-            columns = [col for col in self._data.keys()]
-            placeholders = ', '.join(['?'] * len(columns))
-            values = [self._data[col] for col in columns]
-            
-            sql = f"INSERT INTO {self._table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-            cursor.execute(sql, values)
-            
-            if pk:
-                self._data[pk] = cursor.lastrowid
+            columns = tuple(data.keys())
+            values = list(data.values())
+            sql = self._insert_sql_for(columns)
+        
+        with self.acquire() as conn:
+            cursor = conn.execute(sql, values)
+            if pk_value is None and pk:
+                self._assign(pk, cursor.lastrowid)
         
-        conn.commit()
         self._modified.clear()
     
+    @classmethod
+    def bulk_save(cls, objs: List[T], contiguous_ids: bool = True):
+        if not cls._table_name:
+            raise ValueError("Nombre de tabla no definido")
+        
+        pk = cls.get_primary_key()
+        groups: Dict[Tuple[str, ...], List[Tuple[T, List[Any]]]] = {}
+        updates = []
+        for obj in objs:
+            data = obj._column_values()
+            if data.get(pk) is not None:
+                updates.append(obj)
+            else:
+                groups.setdefault(tuple(data.keys()), []).append((obj, list(data.values())))
+        
+        with cls.transaction() as conn:
+            cursor = conn.cursor()
+            for columns, group in groups.items():
+                sql = cls._insert_sql_for(columns)
+                if contiguous_ids:
+                    # Una sola sentencia preparada para todo el grupo. Dentro de
+                    # la transacción SQLite asigna rowids consecutivos, así que
+                    # los IDs se deducen del último insertado
+                    cursor.executemany(sql, [values for _, values in group])
+                    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                    first_id = last_id - len(group) + 1
+                    for offset, (obj, _) in enumerate(group):
+                        obj._assign(pk, first_id + offset)
+                        obj._modified.clear()
+                else:
+                    # Para tablas con triggers u otras inserciones intercaladas
+                    for obj, values in group:
+                        cursor.execute(sql, values)
+                        obj._assign(pk, cursor.lastrowid)
+                        obj._modified.clear()
+            
+            for obj in updates:
+                obj.save()
+    
     def delete(self):
         if not self._table_name:
             raise ValueError("Nombre de tabla no definido")
             
         pk = self.__class__.get_primary_key()
-        pk_value = self._data.get(pk)
+        pk_value = getattr(self, pk, None)
         
         if pk_value is None:
             raise ValueError("No se puede eliminar un registro sin clave primaria")
             
-        conn = self.get_connection()
         sql = f"DELETE FROM {self._table_name} WHERE {pk} = ?"
-        conn.execute(sql, (pk_value,))
-        conn.commit()
+        with self.acquire() as conn:
+            conn.execute(sql, (pk_value,))
+    
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _row_maker(cls, columns: Tuple[str, ...]):
+        # Genera un constructor especializado para la forma del resultado:
+        # cada columna se escribe directamente en su slot por índice
+        namespace = {
+            'new': cls.__new__,
+            'cls': cls,
+            'set_modified': Model._modified.__set__,
+            'set_relations': Model._relations.__set__,
+            'set_extra': Model._extra.__set__,
+        }
+        body = ["    inst = new(cls)", "    set_modified(inst, set())", "    set_relations(inst, {})"]
+        extra = []
+        seen = set()
+        for i, name in enumerate(columns):
+            # Con nombres repetidos (JOIN con SELECT *) gana la primera
+            # columna, como hacía dict(row)
+            if name in seen:
+                continue
+            seen.add(name)
+            if name in cls._fields:
+                namespace[f's{i}'] = getattr(cls, name).__set__
+                converter = getattr(cls._fields[name], 'converter', None)
+                if converter is None:
+                    body.append(f"    s{i}(inst, row[{i}])")
+                else:
+                    # NULL no pasa por el conversor, igual que en sqlite3
+                    namespace[f'c{i}'] = converter
+                    body.append(f"    v = row[{i}]")
+                    body.append(f"    s{i}(inst, None if v is None else c{i}(v))")
+            else:
+                extra.append(f"{name!r}: row[{i}]")
+        body.append(f"    set_extra(inst, {{{', '.join(extra)}}})")
+        body.append("    return inst")
+        
+        exec("def make(row):\n" + "\n".join(body), namespace)
+        return namespace['make']
     
     @classmethod
     def from_row(cls, row: sqlite3.Row) -> T:
-        instance = cls()
-        instance._data = dict(row)
-        instance._modified.clear()
-        return instance
+        return cls._row_maker(tuple(row.keys()))(row)
+    
+    @staticmethod
+    def _relation_name(foreign_key: str) -> str:
+        return foreign_key[:-3] if foreign_key.endswith('_id') else foreign_key
     
     def belongs_to(self, model_class: Type[T], foreign_key: str = None) -> Optional[T]:
         if foreign_key is None:
-            model_name = model_class._table_name.lower()
-            foreign_key = f"{model_name}_id"
+            foreign_key = next(
+                (name for name in self._fk_cols if self._fields[name].model is model_class),
+                f"{model_class._table_name.lower()}_id"
+            )
+        
+        # Relación precargada con QueryBuilder.with_()
+        name = self._relation_name(foreign_key)
+        if name in self._relations:
+            return self._relations[name]
         
-        if foreign_key not in self._data:
+        fk_value = getattr(self, foreign_key, None)
+        if fk_value is None:
             return None
             
-        return model_class.query().where(f"{model_class.get_primary_key()} = ?", self._data[foreign_key]).first()
+        return model_class.query().where(f"{model_class.get_primary_key()} = ?", fk_value).first()
     
     def has_many(self, model_class: Type[T], foreign_key: str = None) -> List[T]:
         if foreign_key is None:
             my_name = self._table_name.lower()
             foreign_key = f"{my_name}_id"
         
-        return model_class.query().where(f"{foreign_key} = ?", self._data[self.get_primary_key()]).all()
+        return model_class.query().where(f"{foreign_key} = ?", getattr(self, self.get_primary_key())).all()
     
     @classmethod
     def query(cls) -> 'QueryBuilder':
         return QueryBuilder(cls)
 
 class QueryBuilder:
+    # SQL generado por forma de la consulta; los parámetros se enlazan aparte
+    _sql_cache: Dict[Tuple[Any, ...], str] = {}
+    _sql_cache_size = 512
+    
     def __init__(self, model_class: Type[Model]):
         self.model_class = model_class
         self._select = '*'
@@ -195,6 +567,7 @@ class QueryBuilder:
         self._order_by = None
         self._group_by = None
         self._having = None
+        self._with = []
     
     def select(self, *columns: str) -> 'QueryBuilder':
         self._select = ', '.join(columns) if columns else '*'
@@ -206,6 +579,7 @@ class QueryBuilder:
         return self
     
     def join(self, table: str, on: str, join_type: str = 'INNER') -> 'QueryBuilder':
+        _check_identifier(table, _TABLE_REFERENCE)
         self._joins.append(f"{join_type} JOIN {table} ON {on}")
         return self
     
@@ -236,55 +610,217 @@ class QueryBuilder:
         self._params.extend(params)
         return self
     
+    def with_(self, *relations: str) -> 'QueryBuilder':
+        for relation in relations:
+            foreign_key = relation if relation in self.model_class._fk_cols else f"{relation}_id"
+            if foreign_key not in self.model_class._fk_cols:
+                raise ValueError(f"'{self.model_class.__name__}' no tiene la relación '{relation}'")
+            self._with.append(foreign_key)
+        return self
+    
+    def _load_relations(self, instances: List[Model]):
+        # Una consulta IN (...) por relación en vez de una por instancia,
+        # en bloques por debajo del límite de parámetros de SQLite
+        for foreign_key in self._with:
+            related = self.model_class._fields[foreign_key].model
+            pk = related.get_primary_key()
+            name = Model._relation_name(foreign_key)
+            
+            ids = list({getattr(inst, foreign_key, None) for inst in instances} - {None})
+            by_pk = {}
+            for start in range(0, len(ids), 900):
+                chunk = ids[start:start + 900]
+                placeholders = ', '.join(['?'] * len(chunk))
+                for obj in related.query().where(f"{pk} IN ({placeholders})", *chunk).all():
+                    by_pk[getattr(obj, pk)] = obj
+            
+            for inst in instances:
+                inst._relations[name] = by_pk.get(getattr(inst, foreign_key, None))
+    
     def _build_query(self) -> Tuple[str, List[Any]]:
-        sql = f"SELECT {self._select} FROM {self.model_class._table_name}"
+        # LIMIT/OFFSET se enlazan como parámetros para que el texto SQL sea
+        # estable y sqlite3 reutilice la sentencia preparada
+        sql = self._cached_sql()
         
-        if self._joins:
-            sql += " " + " ".join(self._joins)
+        params = list(self._params)
+        if self._limit is not None:
+            params.append(self._limit)
+        if self._offset is not None:
+            params.append(self._offset)
         
-        if self._where:
-            sql += " WHERE " + " AND ".join(self._where)
+        return sql, params
+    
+    @property
+    def _cache_key(self) -> Tuple[Any, ...]:
+        return (
+            self.model_class._table_name,
+            self._select,
+            tuple(self._where),
+            tuple(self._joins),
+            self._order_by,
+            self._group_by,
+            self._having,
+            self._limit is None,
+            self._offset is None
+        )
+    
+    def _cached_sql(self, kind: Union[str, Tuple[str, str]] = 'select') -> str:
+        key = (kind,) + self._cache_key
+        sql = QueryBuilder._sql_cache.get(key)
+        if sql is not None:
+            return sql
         
-        if self._group_by:
-            sql += f" GROUP BY {self._group_by}"
+        table, select, where, joins, order_by, group_by, having, no_limit, no_offset = key[1:]
+        if isinstance(kind, tuple):
+            # Agregado (función, columna): ORDER BY no cambia el resultado;
+            # con LIMIT/OFFSET se agrega sobre las filas de la subconsulta
+            function, column = kind
+            if no_limit and no_offset:
+                sql = self._compile(table, f"{function}({column})", where, joins, None, None, None, True, True)
+            else:
+                inner = self._compile(table, select, where, joins, order_by, None, None, no_limit, no_offset)
+                sql = f"SELECT {function}({column.split('.')[-1]}) FROM ({inner})"
+        elif kind == 'count':
+            # ORDER BY, LIMIT y OFFSET no afectan al total
+            if group_by or having:
+                inner = self._compile(table, select, where, joins, None, group_by, having, True, True)
+                sql = f"SELECT COUNT(*) FROM ({inner})"
+            else:
+                sql = self._compile(table, 'COUNT(*)', where, joins, None, None, None, True, True)
+        elif kind == 'exists':
+            # SQLite se detiene en la primera fila encontrada
+            sql = self._compile(table, '1', where, joins, None, group_by, having, False, True)
+        else:
+            sql = self._compile(*key[1:])
         
-        if self._having:
-            sql += f" HAVING {self._having}"
+        if len(QueryBuilder._sql_cache) >= QueryBuilder._sql_cache_size:
+            QueryBuilder._sql_cache.clear()
+        QueryBuilder._sql_cache[key] = sql
+        return sql
+    
+    @staticmethod
+    def _compile(table: str, select: str, where: Tuple[str, ...], joins: Tuple[str, ...],
+                 order_by: Optional[str], group_by: Optional[str], having: Optional[str],
+                 no_limit: bool, no_offset: bool) -> str:
+        sql = f"SELECT {select} FROM {table}"
         
-        if self._order_by:
-            sql += f" ORDER BY {self._order_by}"
+        if joins:
+            sql += " " + " ".join(joins)
         
-        if self._limit is not None:
-            sql += f" LIMIT {self._limit}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
         
-        if self._offset is not None:
-            sql += f" OFFSET {self._offset}"
+        if group_by:
+            sql += f" GROUP BY {group_by}"
+        
+        if having:
+            sql += f" HAVING {having}"
+        
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        
+        if not no_limit:
+            sql += " LIMIT ?"
+        elif not no_offset:
+            # SQLite no admite OFFSET sin LIMIT
+            sql += " LIMIT -1"
+        
+        if not no_offset:
+            sql += " OFFSET ?"
         
-        return sql, self._params
+        return sql
     
-    def all(self) -> List[Model]:
+    def iter(self) -> Iterator[Model]:
+        # Genera las instancias a medida que se consumen; la conexión queda
+        # ocupada hasta agotar o cerrar el generador
         sql, params = self._build_query()
-        conn = self.model_class.get_connection()
-        cursor = conn.execute(sql, params)
-        
-        return [self.model_class.from_row(row) for row in cursor]
+        with self.model_class.acquire() as conn:
+            # Tuplas simples en vez de sqlite3.Row: el constructor generado
+            # lee por índice y los nombres salen de cursor.description
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(sql, params)
+            make = self.model_class._row_maker(tuple(d[0] for d in cursor.description))
+            
+            while True:
+                batch = cursor.fetchmany(512)
+                if not batch:
+                    break
+                instances = [make(row) for row in batch]
+                if self._with:
+                    # Las relaciones se cargan con esta misma conexión
+                    local = Model._local
+                    held, local.conn = local.conn, conn
+                    try:
+                        self._load_relations(instances)
+                    finally:
+                        local.conn = held
+                yield from instances
+    
+    def all(self) -> List[Model]:
+        return list(self.iter())
     
     def first(self) -> Optional[Model]:
         self._limit = 1
-        results = self.all()
-        return results[0] if results else None
+        results = self.iter()
+        try:
+            return next(results, None)
+        finally:
+            results.close()
     
-    def count(self) -> int:
-        sql = f"SELECT COUNT(*) FROM {self.model_class._table_name}"
-        params = []
-        
-        if self._where:
-            sql += " WHERE " + " AND ".join(self._where)
-            params = self._params[:len(self._where)]
+    def _build_query_selecting(self, select: str) -> Tuple[str, List[Any]]:
+        # Usa otra lista de columnas sin alterar la consulta, que sigue
+        # siendo reutilizable como en count() y exists()
+        original, self._select = self._select, select
+        try:
+            return self._build_query()
+        finally:
+            self._select = original
+    
+    def _aggregate(self, function: str, column: str) -> Any:
+        # El cálculo se hace dentro de SQLite: solo vuelve un escalar
+        _check_identifier(column)
+        if self._group_by or self._having:
+            raise ValueError(f"{function}() no admite GROUP BY/HAVING: usa select() o raw()")
         
-        conn = self.model_class.get_connection()
-        cursor = conn.execute(sql, params)
-        return cursor.fetchone()[0]
+        sql = self._cached_sql((function, column))
+        params = list(self._params)
+        if self._limit is not None:
+            params.append(self._limit)
+        if self._offset is not None:
+            params.append(self._offset)
+        with self.model_class.acquire() as conn:
+            return conn.execute(sql, params).fetchone()[0]
+    
+    def sum(self, column: str) -> Any:
+        return self._aggregate('SUM', column)
+    
+    def avg(self, column: str) -> Optional[float]:
+        return self._aggregate('AVG', column)
+    
+    def max(self, column: str) -> Any:
+        return self._aggregate('MAX', column)
+    
+    def min(self, column: str) -> Any:
+        return self._aggregate('MIN', column)
+    
+    def pluck(self, column: str) -> List[Any]:
+        _check_identifier(column)
+        sql, params = self._build_query_selecting(column)
+        with self.model_class.acquire() as conn:
+            return [row[0] for row in conn.execute(sql, params)]
+    
+    def raw(self, sql: str, params: Union[List[Any], Tuple[Any, ...]] = ()) -> List[sqlite3.Row]:
+        # Devuelve las filas tal cual, sin construir instancias del modelo
+        with self.model_class.acquire() as conn:
+            return conn.execute(sql, params).fetchall()
+    
+    def count(self) -> int:
+        sql = self._cached_sql('count')
+        with self.model_class.acquire() as conn:
+            return conn.execute(sql, self._params).fetchone()[0]
     
     def exists(self) -> bool:
-        return self.count() > 0
+        sql = self._cached_sql('exists')
+        with self.model_class.acquire() as conn:
+            return conn.execute(sql, self._params + [1]).fetchone() is not None